@@ -6,10 +6,11 @@ import logging.config
 import os
 from abc import ABC, abstractmethod
 from collections import Counter
+from heapq import heapify, heappop, heappush
 from json import JSONEncoder
 from random import sample, shuffle
 
-from PandemicGameData import allCities, infectionCards, playerCards
+from PandemicBoards import default_board
 
 # Game object will use builder pattern to create a game board, players, and decks
 # The actions will use the command pattern to call the appropriate methods on the game board
@@ -19,16 +20,20 @@ from PandemicGameData import allCities, infectionCards, playerCards
 
 
 class Game(object):
-    def __init__(self, number_of_players, number_of_AI=0, number_of_epidemics=4):
+    def __init__(self, number_of_players, number_of_AI=0, number_of_epidemics=4, board=None, save_states=True):
         formatter = logging.Formatter('%(message)s')
         logging.basicConfig(filename='Pandemic.log', level=logging.DEBUG,
                             format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         self.actionlogging = logging.getLogger("Action Logger")
         self.actionlogging.setLevel(logging.DEBUG)
-        self.actionlogConsole = logging.StreamHandler()
-        self.actionlogConsole.setLevel(logging.DEBUG)
-        self.actionlogConsole.setFormatter(formatter)
-        self.actionlogging.addHandler(self.actionlogConsole)
+        # the logger is shared between games so only give it one console handler
+        if not self.actionlogging.handlers:
+            self.actionlogConsole = logging.StreamHandler()
+            self.actionlogConsole.setLevel(logging.DEBUG)
+            self.actionlogConsole.setFormatter(formatter)
+            self.actionlogging.addHandler(self.actionlogConsole)
+        # set to False to skip writing the GameState files, e.g. when simulating lots of games
+        self.save_states = save_states
 
         # step 1: setup players
         self.turncounter = 1
@@ -41,44 +46,54 @@ class Game(object):
                                "Contingency_Planner": [5],
                                "Quarantine_Specialist": [6]
                                }
-        self.PlayerRoles = sample(self.AvailableRoles.keys(
-        ), k=self.number_of_players + self.number_of_AI)
+        self.PlayerRoles = sample(list(self.AvailableRoles),
+                                  k=self.number_of_players + self.number_of_AI)
         self.Players = []
         self.gameCities = {}
+        # the cities, decks and cube supply to play with. See PandemicBoards for bigger made up boards.
+        self.Board = board or default_board()
+        self.CardIndex = self.Board.card_index
+        self.CardNames = self.Board.card_names
+        self.CardColours = self.Board.card_colours
         self.PlayerDeck_Discards = []
         self.InfectionDeck_Discards = []
         self.number_of_epidemics = number_of_epidemics
         self.CuredDiseases = []
         self.Outbreaks = 0
         self.EradicatedDiseases = []
-        self.InfectionCubes = {
-            'Red': 24,
-            'Blue': 24,
-            'Yellow': 24,
-            'Black': 24
-        }
+        self.InfectionCubes = dict(self.Board.infection_cubes)
         self.epidemicpulls = 0
+        # 'Win' or 'Loss' once the game is over. Set by EndConditions as things happen, see is_terminal.
+        self.result = None
+        self.result_reason = None
+        self.EndConditions = EndConditions(game=self)
         self.draw_states = {0: 2, 1: 2, 2: 2, 3: 3, 4: 3, 5: 4, 6: 4}
         self.draw_requirements = self.draw_states[self.epidemicpulls]
 
     def create_players_cities_and_deck(self):
         self.GameState = GameState(game=self)
         # creates game players, decks, and cities
-        self.PlayerDeck = PlayerDeck(playerCards, game=self)
-        self.InfectionDeck = InfectionDeck(infectionCards, game=self)
+        # decks get copies as they are shuffled and drawn from in place
+        self.PlayerDeck = PlayerDeck(list(self.Board.player_cards), game=self)
+        self.InfectionDeck = InfectionDeck(list(self.Board.infection_cards), game=self)
         if self.number_of_players > 0:
             for i in range(self.number_of_players):
                 self.Players.append(
-                    Player(f'Player: {i+1}', self.PlayerRoles[i], game=self))
+                    Player(f'Player: {i+1}', self.PlayerRoles[i], location=self.Board.start_city, game=self))
         if self.number_of_AI > 0:
             for i in range(self.number_of_AI):
                 self.Players.append(
-                    AiPlayer(f'AI: {i+1}', self.PlayerRoles[self.number_of_players + i], game=self))
+                    AiPlayer(f'AI: {i+1}', self.PlayerRoles[self.number_of_players + i],
+                             location=self.Board.start_city, game=self))
         for player in self.Players:
             self.actionlogging.info(player.role)
-        for city in allCities:
+        for city in self.Board.cities:
             self.gameCities[city[0]] = City(
                 city[0], city[1], city[2], city[3], city[4], game=self)
+        self.DeckBeliefs = DeckBeliefs(game=self)
+        self.OutbreakRisk = OutbreakRisk(game=self)
+        # the game starts with a research station in the starting city
+        self.gameCities[self.Board.start_city].research_station = True
 
     def set_items(self):
         # Now the number of players and AIs are set, roles assigned, and added to the "Game"number_of_AI
@@ -108,17 +123,59 @@ class Game(object):
     def setup_game(self):
         self.create_players_cities_and_deck()
         self.set_items()
-        self.GameState.save_state()  # for ai data
-        self.GameState.save_initial_state()
+        if self.save_states:
+            self.GameState.save_state()  # for ai data
+            self.GameState.save_initial_state()
+
+    def epidemic(self):
+        '''
+        Resolves an epidemic card.
+        1 the infection rate goes up. 2 the bottom infection card gets 3 cubes.
+        3 the infection discards are shuffled and put back on top of the infection deck.
+        '''
+        self.epidemicpulls += 1
+        self.draw_requirements = self.draw_states[min(self.epidemicpulls, max(self.draw_states))]
+        self.actionlogging.info(f'Epidemic! The infection rate is now {self.draw_requirements}.')
+        if self.InfectionDeck.deck:
+            card = self.InfectionDeck.draw(0)
+            city = self.gameCities[card[0]]
+            # fill the city up to 3 cubes of the colour. If it already had some, it also outbreaks.
+            had_cubes = city.cubes[card[2]] > 0
+            if card[2] in self.EradicatedDiseases:
+                self.actionlogging.info(f'{card[2]} is eradicated, no cubes are placed on {city.name}.')
+            elif city.cubes[card[2]] < 3:
+                city.place_cubes(card[2], 3 - city.cubes[card[2]])
+            if had_cubes:
+                city.outbreak(card[2])
+            if self.is_terminal():
+                return
+        self.InfectionDeck.intensify()
 
     def start_turn(self):
-        player = iter(self.Players)
-        while True:
-            try:
-                self.Turn = Turn(next(player), self.turncounter, game=self)
+        while not self.is_terminal():
+            for player in self.Players:
+                self.Turn = Turn(player, self.turncounter, game=self)
                 self.Turn.start_turn()
-            except StopIteration:
-                self.start_turn()
+                if self.is_terminal():
+                    break
+
+    def play_turn(self, choose):
+        '''
+        Plays the next player's turn with choose(game, player, actions) making every decision,
+        including discards. actions come from Turn.legal_actions(). For AI players and simulations.
+        '''
+        player = self.Players[(self.turncounter - 1) % len(self.Players)]
+        self.Turn = Turn(player, self.turncounter, game=self)
+        while self.Turn.player_actions > 0 and not self.is_terminal():
+            actions_left = self.Turn.player_actions
+            self.Turn.take_action(*choose(self, player, self.Turn.legal_actions()))
+            if self.Turn.player_actions == actions_left:  # the action didn't go through, don't spin forever
+                self.Turn.player_actions = 0
+        if not self.is_terminal():
+            self.Turn.end_turn(choose)
+
+    def is_terminal(self):
+        return self.result is not None
 
 
 class GameState:
@@ -146,13 +203,42 @@ class GameState:
         self.game_state['City_Status'] = [[self.game.gameCities[city].city_id, self.game.gameCities[city].cubes,
                                            self.game.gameCities[city].total_cubes, self.game.gameCities[city].connection_ids] for city in self.game.gameCities]
         self.game_state['Player_Status'] = [[player.name, str(
-            player.role), player.hand, player.location] for player in self.game.Players]
-        self.game_state['Board_Status'] = [[self.game.turncounter,
-                                            self.game.number_of_epidemics, self.game.PlayerDeck_Discards]]
+            player.role), player.hand.card_names(), player.hand.mask, player.location] for player in self.game.Players]
+        self.game_state['Board_Status'] = [[self.game.turncounter, self.game.number_of_epidemics,
+                                            [self.game.CardNames[card_id] for card_id in self.game.PlayerDeck_Discards]]]
         self.game_state['Infection_Status'] = [[self.game.InfectionDeck_Discards,
                                                 self.game.InfectionCubes, self.game.epidemicpulls, self.game.Outbreaks]]
         self.game_state['Cure_Status'] = [
             self.game.CuredDiseases, self.game.EradicatedDiseases]
+        self.game_state['Belief_Status'] = [self.game.DeckBeliefs.infection_probabilities,
+                                            self.game.DeckBeliefs.epidemic_next_draw,
+                                            self.game.DeckBeliefs.epidemic_next_turn]
+        self.game_state['Risk_Status'] = [self.game.OutbreakRisk.risk]
+
+    def encode(self):  # for ai training data
+        '''
+        Flattens the board into one list of numbers so it can be stored as a row of a training file.
+        Cities are in gameCities order and colours in InfectionCubes order so every row of a run lines up.
+        Per city: cubes of each colour and whether it has a research station.
+        Per player: a one hot of their location and their hand (see PlayerHand.encode).
+        Then the turn, epidemics pulled, outbreaks, cubes left of each colour and cured/eradicated flags.
+        '''
+        colours = list(self.game.InfectionCubes)
+        city_names = list(self.game.gameCities)
+        encoding = []
+        for city in self.game.gameCities.values():
+            encoding.extend(city.cubes[colour] for colour in colours)
+            encoding.append(int(city.research_station))
+        for player in self.game.Players:
+            location = [0] * len(city_names)
+            location[city_names.index(player.location)] = 1
+            encoding.extend(location)
+            encoding.extend(player.hand.encode())
+        encoding.extend([self.game.turncounter, self.game.epidemicpulls, self.game.Outbreaks])
+        encoding.extend(self.game.InfectionCubes[colour] for colour in colours)
+        encoding.extend(int(colour in self.game.CuredDiseases) for colour in colours)
+        encoding.extend(int(colour in self.game.EradicatedDiseases) for colour in colours)
+        return encoding
 
     def save_state(self):  # for ai data
         self.get_state()
@@ -196,7 +282,8 @@ class GameState:
         self.game.__dict__['PlayerDeck'].deck = data['player_deck']
         self.game.__dict__['InfectionDeck'].deck = data['infection_deck']
         for player, cards in zip(self.game.Players, data['player_cards']):
-            player.hand = cards
+            player.hand.clear()
+            player.hand.extend(cards[0])
 
 
 class PlayerDeck(object):
@@ -221,17 +308,27 @@ class PlayerDeck(object):
 
     def draw(self, index=None):
         '''
-        Draws a card from the deck.
+        Draws a card from the deck. Returns None and loses the game if there are no cards left.
         '''
+        if not self.deck:
+            self.game.EndConditions.player_deck_empty()
+            return None
         if index is None:
-            return self.deck.pop()
+            card = self.deck.pop()
         else:
-            return self.deck.pop(index)
+            card = self.deck.pop(index)
+        self.game.DeckBeliefs.player_card_drawn(card)
+        return card
 
     def chunk_cards(self, deck, epidemic_cards):
-        # generator that chunks the cards into groups based on the number of epidemic cards
-        for i in range(0, len(deck), round(len(deck)/epidemic_cards)):
-            yield deck[i:i + round(len(deck)/epidemic_cards)]
+        # generator that chunks the cards into exactly one group per epidemic card.
+        # group sizes differ by at most one, with the bigger groups at the end of the list (the top of the deck)
+        size, extra = divmod(len(deck), epidemic_cards)
+        start = 0
+        for num in range(epidemic_cards):
+            end = start + size + (1 if num >= epidemic_cards - extra else 0)
+            yield deck[start:end]
+            start = end
 
     def add_epidemic_cards(self):
         '''
@@ -240,13 +337,16 @@ class PlayerDeck(object):
         Then combine the sections back into one deck. Below mimics this behavior. 
         '''
         chunk_list = []
+        pile_sizes = []
         for num, chunk in enumerate(self.chunk_cards(self.deck, self.game.number_of_epidemics)):
             chunk.append(["Epidemic", [5, 6, num+1]])
             shuffle(chunk)
+            pile_sizes.append(len(chunk))
             for item in chunk:
                 chunk_list.append(item)
 
         self.deck = chunk_list
+        self.game.DeckBeliefs.set_epidemic_piles(pile_sizes)
 
 
 class Turn(object):
@@ -262,11 +362,58 @@ class Turn(object):
         self.game = game
         self.current_outbreaks = []
         self.player_actions = 4
+        self.hand_limit = 7
         self.MoveReceiver = MoveReceiver()
         self.UpdateCardsReceiver = UpdateCardsReceiver()
         self.GeneralActionReceiver = GeneralActionReceiver()
         self.ActionInvoker = ActionInvoker()
 
+    def legal_actions(self):
+        '''
+        Every action the player can take right now as (action, target) pairs, for AI players and simulations.
+        Targets are city names for movement and colours for Treat and Discover Cure.
+        While the player is over the hand limit the only actions are ('Discard', card name) for each card held.
+        '''
+        if self.over_hand_limit():
+            return [('Discard', self.game.CardNames[card_id]) for card_id in self.player.hand]
+        location = self.game.gameCities[self.player.location]
+        actions = [('Move', city) for city in location.connected_cities if city in self.game.gameCities]
+        actions += [('Direct Flight', city) for city in self.player.hand.city_names()
+                    if city != self.player.location and city in self.game.gameCities]
+        if self.player.hand.has_card(self.player.location):
+            actions += [('Charter Flight', city) for city in self.game.gameCities if city != self.player.location]
+        actions += [('Treat', color) for color, cubes in location.cubes.items() if cubes > 0]
+        if location.research_station:
+            actions += [('Discover Cure', color) for color in self.game.InfectionCubes
+                        if color not in self.game.CuredDiseases and self.player.hand.can_cure(color)]
+        actions.append(('Pass', None))
+        return actions
+
+    def take_action(self, action, target=None):
+        '''
+        Non interactive version of player_action. Runs one action through the same commands.
+        '''
+        if action == 'Move':
+            command = Move(self.MoveReceiver, self.player, target, game=self.game)
+        elif action == 'Direct Flight':
+            command = DirectFlight(self.MoveReceiver, self.player, target, game=self.game)
+        elif action == 'Charter Flight':
+            command = CharterFlight(self.MoveReceiver, self.player, target, game=self.game)
+        elif action == 'Treat':
+            command = Treat(self.GeneralActionReceiver, self.player, target, game=self.game)
+        elif action == 'Discover Cure':
+            command = DiscoverCure(self.GeneralActionReceiver, self.player, target, game=self.game)
+        elif action == 'Discard':
+            command = Discard(self.UpdateCardsReceiver, self.player, target, game=self.game)
+        elif action == 'Pass':
+            self.player_actions = 0
+            return
+        else:
+            logging.warning('Invalid action!')
+            return
+        self.ActionInvoker.set_on_start(command)
+        self.ActionInvoker.perform_action()
+
     def start_turn(self):
         self.game.actionlogging.info(
             f'{self.player.name} is starting turn {self.turncounter}')
@@ -307,7 +454,7 @@ class Turn(object):
 
                 elif action == 'Direct Flight':
                     self.game.actionlogging.info(
-                        f'You are in {self.player.location} and can directly fly to {[i[0] for i in self.player.hand]}'
+                        f'You are in {self.player.location} and can directly fly to {self.player.hand.city_names()}'
                     )
                     self.target_city = input(
                         f'Where you would like to fly to? '
@@ -371,21 +518,52 @@ class Turn(object):
                 self.game.actionlogging.debug(
                     f'The error happened in the turn object. {e}')
 
-    def end_turn(self):
+    def over_hand_limit(self):
+        return len(self.player.hand) > self.hand_limit
+
+    def default_discard(self):
         '''
-        This method will be called at the end of the turn.
-        It will reset the player actions to 4 and then call the game object to end the turn.
+        The discard used when nobody chooses one: a card of the colour the player holds fewest of.
+        Event cards are kept as long as there is a city card to let go of.
         '''
+        return self.game.CardNames[min(self.player.hand, key=lambda card_id: (
+            self.game.CardColours[card_id] is None,
+            self.player.hand.colour_count(self.game.CardColours[card_id])))]
 
-        # for i in range(self.game.draw_requirements):
-        #     card = self.player.deck.draw()
-        #     if card[0] == 'Epidemic':
-        #         #shuffle infection deck discard pile
-        #         #place them on top, then draw
+    def end_turn(self, choose=None):
+        '''
+        This method will be called at the end of the turn.
+        The player draws two cards, resolving any epidemics, then the infection deck infects cities
+        at the current infection rate before the game moves on to the next turn.
+        choose(game, player, actions) picks the discards when the hand goes over the limit,
+        the same as it picks actions. Without it default_discard is used.
+        '''
+        for i in range(2):
+            if self.game.is_terminal():  # e.g. the first card was an epidemic that lost the game
+                break
+            card = self.game.PlayerDeck.draw()
+            if card is None:
+                break
+            if card[0] == 'Epidemic':
+                self.game.epidemic()
+            else:
+                self.player.hand.append(card)
+        while self.over_hand_limit() and not self.game.is_terminal():
+            actions = self.legal_actions()
+            action = choose(self.game, self.player, actions) if choose else None
+            if action not in actions:
+                action = ('Discard', self.default_discard())
+            self.take_action(*action)
+
+        for i in range(self.game.draw_requirements):
+            if not self.game.InfectionDeck.deck or self.game.is_terminal():
+                break
+            self.game.InfectionDeck.infect_city(1)
 
         self.game.actionlogging.info(self.player.hand)
         self.game.turncounter += 1
-        self.game.GameState.save_state()
+        if self.game.save_states:
+            self.game.GameState.save_state()
         self.game.actionlogging.info(
             f'{self.player.name} has finished their turn.')
         return None
@@ -409,17 +587,19 @@ class InfectionDeck(object):
         Shuffles the deck.
         '''
         shuffle(self.deck)
+        self.game.DeckBeliefs.reset_infection_deck(self.deck)
 
     def draw(self, index=None):
         '''
         Draws a card from the deck.
         '''
         if index is None:
-            self.game.InfectionDeck_Discards.append(self.deck.pop())
-            return self.deck.pop()
+            card = self.deck.pop()
         else:
-            self.game.InfectionDeck_Discards.append(self.deck.pop(index))
-            return self.deck.pop(index)
+            card = self.deck.pop(index)
+        self.game.InfectionDeck_Discards.append(card)
+        self.game.DeckBeliefs.infection_card_drawn(card)
+        return card
 
     def infect_city(self, num_of_cubes=1):
         '''
@@ -427,10 +607,325 @@ class InfectionDeck(object):
         gives the city object the color which to infect itself.
         '''
         city_to_infect = self.draw()
-        for city in self.game.gameCities:
-            if city_to_infect[0] == city:
-                self.game.gameCities[city].infect_self(
-                    city_to_infect[2], num_of_cubes)
+        self.game.gameCities[city_to_infect[0]].infect_self(
+            city_to_infect[2], num_of_cubes)
+
+    def intensify(self):
+        '''
+        Shuffles the infection discards and puts them back on top of the deck. Part of an epidemic.
+        '''
+        discards = list(self.game.InfectionDeck_Discards)
+        shuffle(discards)
+        self.deck.extend(discards)  # the top of the deck is the end of the list
+        self.game.InfectionDeck_Discards.clear()
+        self.game.DeckBeliefs.add_infection_layer([card[0] for card in discards])
+
+
+class InfectionLayer(object):
+    '''
+    A run of shuffled cards in the infection deck. Every city in it has the same chance of being drawn next turn.
+    '''
+
+    def __init__(self, cities):
+        self.cities = set(cities)
+        self.probability = 0.0
+
+    def __repr__(self):
+        return f'InfectionLayer of {len(self.cities)} cities'
+
+
+class DeckBeliefs(object):
+    '''
+    Keeps what the players can know about the two hidden decks, updated a card at a time as they are drawn.
+
+    Infection deck: the deck is a stack of layers. After a shuffle it is one layer holding every card.
+    When an epidemic puts the shuffled discards back on top, they become a new top layer.
+    Cards are drawn from the top layer down, so with k draws a turn every city in a layer fully
+    covered by the k draws is certain to be infected, a city in the partly covered layer has
+    (draws left)/(layer size) chance, and the rest have none.
+    The chance is kept once per layer, so a draw only updates the few layers the next turn's draws reach,
+    not the cities in them. Look a city up with infection_probability.
+
+    Player deck: add_epidemic_cards cuts the deck into piles with one epidemic each.
+    Knowing the pile sizes and which epidemics have been drawn gives the chance the next draw is an epidemic.
+
+    infection_probabilities builds the full array in gameCities order to line up with GameState.get_state.
+    '''
+
+    def __init__(self, game=None):
+        self.game = game
+        self.city_position = {name: num for num, name in enumerate(self.game.gameCities)}
+        self.layers = []  # bottom layer first, top layer last
+        self.city_layer = {}
+        self.covered_layers = []
+        self.epidemic_piles = []  # [cards left, epidemic still in pile] with the top pile last
+        self.epidemic_next_draw = 0.0
+        self.epidemic_next_turn = 0.0
+
+    def infection_probability(self, city):
+        layer = self.city_layer.get(city)
+        return layer.probability if layer is not None else 0.0
+
+    @property
+    def infection_probabilities(self):
+        return [self.infection_probability(city) for city in self.city_position]
+
+    def reset_infection_deck(self, deck):
+        '''
+        The whole deck has just been shuffled so every card is in one layer.
+        '''
+        self.layers = []
+        self.city_layer = {}
+        self.covered_layers = []
+        self.game.OutbreakRisk.layers_reset()
+        self.add_infection_layer([card[0] for card in deck])
+
+    def add_infection_layer(self, cities):
+        '''
+        Shuffled cards have been put on top of the infection deck, e.g. the discards during an epidemic.
+        '''
+        layer = InfectionLayer(cities)
+        for city in layer.cities:
+            self.city_layer[city] = layer
+        self.layers.append(layer)
+        self.game.OutbreakRisk.layer_added(layer)
+        self.refresh()
+
+    def infection_card_drawn(self, card):
+        layer = self.city_layer.pop(card[0], None)
+        if layer is not None:
+            layer.cities.discard(card[0])
+            if not layer.cities:  # top layer used up, or the bottom card pulled in an epidemic
+                self.layers.remove(layer)
+            self.game.OutbreakRisk.card_drawn(card[0], layer)
+        self.refresh()
+
+    def refresh(self):
+        '''
+        Updates the chance of the layers the next infection draws can reach.
+        Call when the layers change or the infection rate goes up.
+        '''
+        old_covered = self.covered_layers
+        for layer in old_covered:
+            layer.probability = 0.0
+        self.covered_layers = []
+        draws_left = self.game.draw_requirements
+        for layer in reversed(self.layers):
+            if draws_left <= 0:
+                break
+            layer.probability = min(1.0, draws_left / len(layer.cities))
+            self.covered_layers.append(layer)
+            draws_left -= len(layer.cities)
+        self.game.OutbreakRisk.layers_changed(set(old_covered) | set(self.covered_layers))
+
+    def set_epidemic_piles(self, pile_sizes):
+        '''
+        Takes the pile sizes from PlayerDeck.add_epidemic_cards in deck order. The last pile is drawn first.
+        '''
+        self.epidemic_piles = [[size, True] for size in pile_sizes]
+        self.update_epidemic_chances()
+
+    def player_card_drawn(self, card):
+        if not self.epidemic_piles:  # cards dealt before the epidemics are added
+            return
+        pile = self.epidemic_piles[-1]
+        pile[0] -= 1
+        if card[0] == 'Epidemic':
+            pile[1] = False
+        if pile[0] == 0:
+            self.epidemic_piles.pop()
+        self.update_epidemic_chances()
+
+    def update_epidemic_chances(self, draws_per_turn=2):
+        '''
+        With one epidemic in a pile of n cards, the chance of missing it over t draws is (n - t) / n.
+        '''
+        chance_of_none = 1.0
+        draws_left = draws_per_turn
+        for cards_left, has_epidemic in reversed(self.epidemic_piles):
+            draws = min(draws_left, cards_left)
+            if draws_left == draws_per_turn:
+                self.epidemic_next_draw = 1 / cards_left if has_epidemic else 0.0
+            if has_epidemic:
+                chance_of_none *= (cards_left - draws) / cards_left
+            draws_left -= draws
+            if draws_left == 0:
+                break
+        else:
+            if draws_left == draws_per_turn:
+                self.epidemic_next_draw = 0.0
+        self.epidemic_next_turn = 1 - chance_of_none
+
+
+class OutbreakRisk(object):
+    '''
+    A per city outbreak risk score kept up to date as cubes and infection chances change.
+
+    Only a city on 3 cubes can outbreak next turn, so every other city scores 0. For a city on 3 cubes
+    risk = own + spill
+    own: the chance the city is infected next turn (DeckBeliefs) times 1 + how many of its connections
+         are also on 3 cubes and would outbreak in turn.
+    spill: for every city on 3 cubes that has this city as a connection,
+           the chance that city is infected next turn and so outbreaks onto this one.
+
+    A cube change only touches the city, the cities it connects to and the cities connecting to it,
+    so it is O(connections) rather than a pass over the board.
+    When a draw changes the chance of a layer, only the cities on 3 cubes in that layer and their
+    connections are re-scored. There can't be more of those than the cube supply allows, however big the board.
+    Scores also go on a max heap with stale entries skipped, so top(k) is O(k log n).
+    '''
+
+    def __init__(self, game=None):
+        self.game = game
+        self.city_position = {name: num for num, name in enumerate(self.game.gameCities)}
+        self.cities = list(self.game.gameCities.values())
+        self.connections = [[self.city_position[connection] for connection in city.connected_cities
+                             if connection in self.city_position] for city in self.cities]
+        # connections are one way in the data, so keep who can spill into each city
+        self.spill_sources = [[] for city in self.cities]
+        for position, connections in enumerate(self.connections):
+            for connection in connections:
+                self.spill_sources[connection].append(position)
+        self.risk = [0.0] * len(self.cities)
+        self.versions = [0] * len(self.cities)
+        self.heap = []
+        self.layer_saturated = {}  # InfectionLayer: positions of the cities on 3 cubes in it
+
+    def saturated(self, position):
+        return self.cities[position].total_cubes >= 3
+
+    def infection_probability(self, position):
+        return self.game.DeckBeliefs.infection_probability(self.cities[position].name)
+
+    def city_changed(self, city):
+        '''
+        Call after a city's cubes change.
+        '''
+        position = self.city_position[city.name]
+        layer = self.game.DeckBeliefs.city_layer.get(city.name)
+        if layer in self.layer_saturated:
+            if self.saturated(position):
+                self.layer_saturated[layer].add(position)
+            else:
+                self.layer_saturated[layer].discard(position)
+        self.update_cities({position, *self.connections[position], *self.spill_sources[position]})
+
+    def layers_reset(self):
+        '''
+        Call when the infection deck is reshuffled and its layers are thrown away.
+        '''
+        self.layer_saturated = {}
+
+    def layer_added(self, layer):
+        self.layer_saturated[layer] = {self.city_position[name] for name in layer.cities
+                                       if self.saturated(self.city_position[name])}
+
+    def card_drawn(self, city, layer):
+        '''
+        Call once a drawn city has been taken out of its layer.
+        '''
+        position = self.city_position[city]
+        saturated = self.layer_saturated.get(layer, set())
+        saturated.discard(position)
+        if not layer.cities:
+            self.layer_saturated.pop(layer, None)
+        self.update_cities({position, *self.connections[position]})
+
+    def layers_changed(self, layers):
+        '''
+        Call with the layers whose infection chance changed.
+        '''
+        positions = set()
+        for layer in layers:
+            for position in self.layer_saturated.get(layer, ()):
+                positions.add(position)
+                positions.update(self.connections[position])
+        self.update_cities(positions)
+
+    def update_cities(self, positions):
+        for position in positions:
+            self.score(position)
+
+    def score(self, position):
+        risk = 0.0
+        if self.saturated(position):
+            chain = sum(1 for connection in self.connections[position] if self.saturated(connection))
+            risk = self.infection_probability(position) * (1 + chain)
+            risk += sum(self.infection_probability(source) for source in self.spill_sources[position]
+                        if self.saturated(source))
+        if risk == self.risk[position]:
+            return
+        self.risk[position] = risk
+        self.versions[position] += 1
+        if risk > 0:
+            heappush(self.heap, (-risk, position, self.versions[position]))
+        if len(self.heap) > 4 * len(self.cities) + 64:
+            self.compact()
+
+    def compact(self):
+        '''
+        Drops the stale heap entries.
+        '''
+        self.heap = [(-self.risk[position], position, self.versions[position])
+                     for position in range(len(self.cities)) if self.risk[position] > 0]
+        heapify(self.heap)
+
+    def top(self, k=5):
+        '''
+        Returns the k riskiest cities as (name, risk), riskiest first. Cities with no risk are left out.
+        '''
+        found = []
+        while self.heap and len(found) < k:
+            entry = heappop(self.heap)
+            if entry[2] == self.versions[entry[1]]:
+                found.append(entry)
+        for entry in found:
+            heappush(self.heap, entry)
+        return [(self.cities[position].name, -risk) for risk, position, version in found]
+
+
+class EndConditions(object):
+    '''
+    Ends the game the moment something happens that ends it, rather than checking the whole board every step.
+    The game objects report events here:
+    loss on the 8th outbreak, a colour's cube supply going below zero, or needing to draw from an empty player deck.
+    win once every disease is cured.
+    A cured disease is eradicated when all its cubes are back in the supply.
+    The first result sticks in Game.result and Game.result_reason.
+    '''
+
+    max_outbreaks = 8
+
+    def __init__(self, game=None):
+        self.game = game
+
+    def end_game(self, result, reason):
+        if self.game.result is None:
+            self.game.result = result
+            self.game.result_reason = reason
+            self.game.actionlogging.info(f'The game is over. {result}: {reason}')
+
+    def outbreak(self):
+        if self.game.Outbreaks >= self.max_outbreaks:
+            self.end_game('Loss', f'{self.game.Outbreaks} outbreaks')
+
+    def cubes_placed(self, color):
+        if self.game.InfectionCubes[color] < 0:
+            self.end_game('Loss', f'ran out of {color} cubes')
+
+    def player_deck_empty(self):
+        self.end_game('Loss', 'the player deck ran out')
+
+    def cubes_removed(self, color):
+        if (color in self.game.CuredDiseases and color not in self.game.EradicatedDiseases
+                and self.game.InfectionCubes[color] >= self.game.Board.infection_cubes[color]):
+            self.game.EradicatedDiseases.append(color)
+            self.game.actionlogging.info(f'{color} has been eradicated!')
+
+    def disease_cured(self, color):
+        self.cubes_removed(color)  # a cure with none of its cubes on the board eradicates it straight away
+        if len(self.game.CuredDiseases) >= len(self.game.InfectionCubes):
+            self.end_game('Win', 'every disease has been cured')
 
 
 class City(object):
@@ -442,55 +937,70 @@ class City(object):
         self.connected_cities = connected_cities
         self.connection_ids = connection_ids
         self.total_cubes = 0
-        self.cubes = {
-            "Blue": 0,
-            "Yellow": 0,
-            "Black": 0,
-            "Red": 0
-        }
+        self.cubes = {color: 0 for color in self.game.InfectionCubes}
 
         self.research_station = False
 
     def __repr__(self):
         return f'{self.name}'
 
-    def infect_self(self, color, num_of_cubes):
+    def infect_self(self, color, num_of_cubes=1, outbreak_chain=None):
         '''
         checks city total cubes and infects if less than 3
+        eradicated diseases never get cubes again, so they don't infect or outbreak
         '''
-        if self.total_cubes < 3:
-            self.cubes[color] += num_of_cubes
-            self.total_cubes += num_of_cubes
-            self.game.InfectionCubes[color] -= num_of_cubes
-            if num_of_cubes > 1:
-                self.game.actionlogging.info(
-                    f'{self.name} has been infected with {num_of_cubes} {color} cubes.')
-            else:
-                self.game.actionlogging.info(
-                    f'{self.name} has been infected with {num_of_cubes} {color} cube.')
+        if color in self.game.EradicatedDiseases:
+            self.game.actionlogging.info(f'{color} is eradicated, no cubes are placed on {self.name}.')
+        elif self.total_cubes < 3:
+            self.place_cubes(color, num_of_cubes)
         else:
-            self.outbreak(color)
+            self.outbreak(color, outbreak_chain)
 
-    def outbreak(self, color):
+    def place_cubes(self, color, num_of_cubes):
+        '''
+        puts cubes from the supply on the city without any outbreak check
+        '''
+        self.cubes[color] += num_of_cubes
+        self.total_cubes += num_of_cubes
+        self.game.InfectionCubes[color] -= num_of_cubes
+        self.game.OutbreakRisk.city_changed(self)
+        self.game.EndConditions.cubes_placed(color)
+        if num_of_cubes > 1:
+            self.game.actionlogging.info(
+                f'{self.name} has been infected with {num_of_cubes} {color} cubes.')
+        else:
+            self.game.actionlogging.info(
+                f'{self.name} has been infected with {num_of_cubes} {color} cube.')
+
+    def outbreak(self, color, outbreak_chain=None):
         '''
         infects all connected cities
+        outbreak_chain holds the cities that have already outbroken in this chain so they don't go off twice.
         '''
+        if outbreak_chain is None:
+            outbreak_chain = set()
+        if self.name in outbreak_chain:
+            return
+        outbreak_chain.add(self.name)
+        self.game.Outbreaks += 1
+        self.game.actionlogging.info(f'{self.name} has had an outbreak!')
+        self.game.EndConditions.outbreak()
         for connection in self.connected_cities:
-            for city in self.game.gameCities:
-                if connection == city.name:
-                    city.infect_self(color)
-                    break
+            if self.game.is_terminal():
+                break
+            if connection in self.game.gameCities:
+                self.game.gameCities[connection].infect_self(color, 1, outbreak_chain)
 
     def treat_self(self, color):
         '''removes specified number of color cubes from self
         The command patter will handle when and how cities treat itself. 
         '''
-        if color in self.game.CuredDiseases:
-            self.game.InfectionCubes[color] += self.cubes[color]
-            self.cubes[color] = 0
-        else:
-            self.game.InfectionCubes[color] += 1
-            self.cubes[color] -= 1
+        removed = self.cubes[color] if color in self.game.CuredDiseases else 1
+        self.game.InfectionCubes[color] += removed
+        self.cubes[color] -= removed
+        self.total_cubes -= removed
+        self.game.OutbreakRisk.city_changed(self)
+        self.game.EndConditions.cubes_removed(color)
 
 
 class Player(object):
@@ -523,12 +1033,136 @@ class AiPlayer(object):
 
 
 class PlayerHand(list):
-    def __init__(self, player):
+    '''
+    Holds the integer card IDs (see Board.card_index) in a player's hand.
+    Cards can be added as IDs, names, or the deck entries themselves e.g. ['Atlanta', [2, 1, 2], 'Blue', 4715000].
+    A bit mask of the held IDs and a count of each colour are kept up to date so
+    membership, colour and cure checks don't have to scan the hand.
+    The standard board's 52 player cards fit in 64 bits; bigger boards just make the mask a bigger int.
+    '''
+
+    def __init__(self, player, cards=()):
+        super().__init__()
         self.player = player
+        self.mask = 0
+        self.colour_counts = Counter()
+        self.extend(cards)
+
+    def __repr__(self):
+        # names rather than IDs so the action log stays readable
+        return repr(self.card_names())
+
+    def card_id(self, card):
+        '''
+        Returns the integer ID of a card ID, card name or deck entry.
+        '''
+        if isinstance(card, int):
+            return card
+        if isinstance(card, str):
+            return self.player.game.CardIndex[card]
+        return self.player.game.CardIndex[card[0]]
+
+    def _added(self, card_id):
+        self.mask |= 1 << card_id
+        self.colour_counts[self.player.game.CardColours[card_id]] += 1
+
+    def _removed(self, card_id):
+        self.mask &= ~(1 << card_id)
+        self.colour_counts[self.player.game.CardColours[card_id]] -= 1
+
+    # every list method that adds or drops cards goes through _added/_removed so mask and colour_counts stay right
+
+    def append(self, card):
+        card_id = self.card_id(card)
+        super().append(card_id)
+        self._added(card_id)
+
+    def extend(self, cards):
+        for card in cards:
+            self.append(card)
+
+    def __iadd__(self, cards):
+        self.extend(cards)
+        return self
+
+    def __imul__(self, times):
+        cards = list(self)
+        self.clear()
+        for i in range(times):
+            self.extend(cards)
+        return self
+
+    def insert(self, index, card):
+        card_id = self.card_id(card)
+        super().insert(index, card_id)
+        self._added(card_id)
+
+    def remove(self, card):
+        card_id = self.card_id(card)
+        super().remove(card_id)
+        self._removed(card_id)
+        return card_id
+
+    def pop(self, index=-1):
+        card_id = super().pop(index)
+        self._removed(card_id)
+        return card_id
+
+    def __setitem__(self, index, cards):
+        old_cards = self[index] if isinstance(index, slice) else [self[index]]
+        if isinstance(index, slice):
+            new_cards = [self.card_id(card) for card in cards]
+        else:
+            new_cards = [self.card_id(cards)]
+        super().__setitem__(index, new_cards if isinstance(index, slice) else new_cards[0])
+        for card_id in old_cards:
+            self._removed(card_id)
+        for card_id in new_cards:
+            self._added(card_id)
+
+    def __delitem__(self, index):
+        old_cards = self[index] if isinstance(index, slice) else [self[index]]
+        super().__delitem__(index)
+        for card_id in old_cards:
+            self._removed(card_id)
+
+    def clear(self):
+        super().clear()
+        self.mask = 0
+        self.colour_counts.clear()
 
     def discard(self, card):
-        self.remove(card)
-        self.player.game.PlayerDeck_Discards.append(card)
+        self.player.game.PlayerDeck_Discards.append(self.remove(card))
+
+    def has_card(self, card):
+        try:
+            return bool(self.mask >> self.card_id(card) & 1)
+        except KeyError:  # not a player card at all e.g. a typo from input()
+            return False
+
+    def colour_count(self, colour):
+        return self.colour_counts[colour]
+
+    def cure_requirement(self):
+        '''
+        Scientists need four cards of the disease's colour, everyone else needs five.
+        '''
+        return 4 if str(self.player.role) == 'Scientist' else 5
+
+    def can_cure(self, colour):
+        return self.colour_counts[colour] >= self.cure_requirement()
+
+    def card_names(self):
+        return [self.player.game.CardNames[card_id] for card_id in self]
+
+    def city_names(self):
+        return [self.player.game.CardNames[card_id] for card_id in self if self.player.game.CardColours[card_id]]
+
+    def encode(self):
+        '''
+        One slot per player card, 1 if held. Ready to drop into the AI's state vector.
+        '''
+        return [self.mask >> card_id & 1 for card_id in range(len(self.player.game.CardNames))]
 
 
 class PlayerRole:
@@ -601,15 +1235,13 @@ class DirectFlight(PlayerAction):
     def execute(self):
         while True:
             try:
-                if self.target_city in [i[0] for i in self.player.hand]:
+                if self.player.hand.has_card(self.target_city):
                     self.receiver.move_player(self.player, self.target_city)
                     self.game.actionlogging.info(
                         f'{self.player.name} has moved to {self.target_city}.'
                     )
                     self.game.Turn.player_actions -= 1
-                    # janky af but works. Uses the index of the list comprehension match to remove card from hand.
-                    self.player.hand.discard(
-                        self.player.hand[[i[0] for i in self.player.hand].index(self.target_city)])
+                    self.player.hand.discard(self.target_city)
                     break
                 else:
                     logging.warning(
@@ -629,7 +1261,7 @@ class CharterFlight(PlayerAction):
         self.receiver = receiver
 
     def city_check(self):
-        if self.player.location in [i[0] for i in self.player.hand]:
+        if self.player.hand.has_card(self.player.location):
             self.game.actionlogging.info(
                 f'{self.player.name} can charter a flight to anywhere.')
             return True
@@ -641,14 +1273,14 @@ class CharterFlight(PlayerAction):
     def execute(self):
         while True:
             try:
+                # the card played is the city being left, so grab it before moving.
+                departure_city = self.player.location
                 self.receiver.move_player(self.player, self.target_city)
                 self.game.actionlogging.info(
                     f'{self.player.name} has moved to {self.target_city}.'
                 )
                 self.game.Turn.player_actions -= 1
-                # janky af but works. Uses the index of the list comprehension match to remove card from hand.
-                self.player.hand.discard(
-                    self.player.hand[[i[0] for i in self.player.hand].index(self.player.location)])
+                self.player.hand.discard(departure_city)
                 break
             except Exception as e:
                 self.game.actionlogging.debug(
@@ -697,29 +1329,62 @@ class ShareKnowledge(PlayerAction):
 
 
 class DiscoverCure(PlayerAction):
-    def __init__(self, receiver: UpdateCardsReceiver, player=None, card_type=None):
+    def __init__(self, receiver: GeneralActionReceiver, player=None, card_type=None, game=None):
+        self.game = game
         self.player = player
         self.card_type = card_type
         self.receiver = receiver
         # if scientist, only need four of same color card
         # else need 5 of same card type
         # player location must have research station
-        # will use collections module to check if the player has the required cards.
-        # check the card amounts against player role and behave accordingly.
 
     def execute(self):
-        pass
+        if not self.game.gameCities[self.player.location].research_station:
+            logging.warning(f'{self.player.name} needs to be at a research station to discover a cure.')
+        elif self.card_type in self.game.CuredDiseases:
+            logging.warning(f'{self.card_type} has already been cured.')
+        elif not self.player.hand.can_cure(self.card_type):
+            logging.warning(f'{self.player.name} does not have enough {self.card_type} cards to discover a cure.')
+        else:
+            cards = [card_id for card_id in self.player.hand
+                     if self.game.CardColours[card_id] == self.card_type][:self.player.hand.cure_requirement()]
+            for card_id in cards:
+                self.player.hand.discard(card_id)
+            self.receiver.cure_disease(self.game, self.card_type)
+            self.game.actionlogging.info(f'{self.player.name} has discovered a cure for {self.card_type}!')
+            self.game.Turn.player_actions -= 1
 
 
 class Treat(PlayerAction):
-    def __init__(self, receiver: GeneralReceiver, player):
+    def __init__(self, receiver: GeneralActionReceiver, player, disease=None, game=None):
+        self.game = game
         self.player = player
-        self.target_player = target_player
         self.disease = disease
         self.receiver = receiver
 
     def execute(self):
-        self.game.actionlogging.info('You have treated a disease!')
+        city = self.game.gameCities[self.player.location]
+        if city.cubes.get(self.disease, 0) > 0:
+            self.receiver.treat_city(city, self.disease)
+            self.game.actionlogging.info('You have treated a disease!')
+            self.game.Turn.player_actions -= 1
+        else:
+            logging.warning(f'There is no {self.disease} to treat in {city.name}.')
+
+
+class Discard(PlayerAction):
+    def __init__(self, receiver: UpdateCardsReceiver, player=None, card=None, game=None):
+        self.game = game
+        self.player = player
+        self.card = card
+        self.receiver = receiver
+
+    def execute(self):
+        if self.player.hand.has_card(self.card):
+            self.receiver.discard_card(self.player, self.card)
+            self.game.actionlogging.info(f'{self.player.name} has discarded {self.card}.')
+        else:
+            logging.warning(f'{self.player.name} does not have {self.card} to discard.')
 
 
 class BuildResearch(PlayerAction):
@@ -767,6 +1432,10 @@ class UpdateCardsReceiver:
         self.player.player_cards.append(self.card)
         return self.player
 
+    def discard_card(self, player, card):
+        player.hand.discard(card)
+        return player
+
 
 class GeneralActionReceiver:
     '''
@@ -777,6 +1446,13 @@ class GeneralActionReceiver:
     def special_action(self):
         self.game.actionlogging.info("Special Action completed!")
 
+    def treat_city(self, city, color):
+        city.treat_self(color)
+
+    def cure_disease(self, game, color):
+        game.CuredDiseases.append(color)
+        game.EndConditions.disease_cured(color)
+
 
 class ActionInvoker:
     '''
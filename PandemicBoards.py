@@ -0,0 +1,135 @@
+import json
+from random import Random
+
+from PandemicGameData import allCards, allCities, infectionCards, playerCards
+
+# Board definitions for Game. The default board is the 48 city map in ./variables/.
+# A board can also be loaded from any file laid out like ./variables/cards.json,
+# or generated with synthetic_board() to stress test the game on much bigger maps.
+
+BASE_COLOURS = ['Blue', 'Black', 'Red', 'Yellow']
+
+
+class Board(object):
+    '''
+    Everything Game needs to build its cities and decks.
+    cities, player_cards and infection_cards use the same layouts as cities.json, player_cards.json and infection_cards.json.
+    infection_cubes is the starting supply of each colour.
+    start_city is where the players and the first research station start. Without one it is the first city.
+    The card tables give every player card a flat integer ID, ordered by Card_ID, for PlayerHand.
+    '''
+
+    def __init__(self, cities, player_cards, infection_cards, infection_cubes, start_city=None):
+        self.cities = cities
+        self.player_cards = player_cards
+        self.infection_cards = infection_cards
+        self.infection_cubes = infection_cubes
+        self.start_city = start_city or cities[0][0]
+        self.card_names = [card[0] for card in sorted(player_cards, key=lambda card: card[1])]
+        self.card_index = {name: num for num, name in enumerate(self.card_names)}
+        # event cards have no colour
+        colours = {card[0]: card[2] for card in player_cards if len(card) > 2}
+        self.card_colours = [colours.get(name) for name in self.card_names]
+
+    def __repr__(self):
+        return f'Board of {len(self.cities)} cities'
+
+
+def default_board():
+    '''
+    The standard 48 city board.
+    '''
+    return Board(allCities, playerCards, infectionCards,
+                 {'Red': 24, 'Blue': 24, 'Yellow': 24, 'Black': 24}, start_city='Atlanta')
+
+
+def board_from_cards(cards, infection_cubes=24, start_city=None):
+    '''
+    Builds a Board from a dict laid out like cards.json:
+    {'Start_City': city, 'Cards': {city: {...}}, 'Events': {event: {...}}}.
+    infection_cubes can be one number for every colour or a dict of colour: cubes.
+    start_city overrides the definition's Start_City.
+    Connections to cities that aren't on the board are dropped.
+    '''
+    city_cards = cards['Cards']
+    cities = []
+    player_cards = []
+    infection_cards = []
+    for name, city in city_cards.items():
+        connections = [connection for connection in city['Connections'] if connection in city_cards]
+        cities.append([name, city['City_ID'], city['Type'], connections,
+                       [city_cards[connection]['City_ID'] for connection in connections]])
+        player_cards.append([name, city['Card_ID'], city['Type'], city['Population']])
+        infection_cards.append([name, city['Infection_ID'], city['Type']])
+    for name, event in cards.get('Events', {}).items():
+        player_cards.append([name, event['Card_ID']])
+    if not isinstance(infection_cubes, dict):
+        colours = list(dict.fromkeys(city[2] for city in cities))
+        infection_cubes = {colour: infection_cubes for colour in colours}
+    return Board(cities, player_cards, infection_cards, infection_cubes, start_city or cards.get('Start_City'))
+
+
+def load_board(path, infection_cubes=24, start_city=None):
+    '''
+    Loads a board from a json file laid out like cards.json, e.g. one saved from synthetic_cards().
+    '''
+    with open(path, 'r') as f:
+        cards = json.load(f)
+    return board_from_cards(cards, infection_cubes, start_city)
+
+
+def synthetic_cards(number_of_cities, degree=4, number_of_colours=4, rewire=0.1, seed=None):
+    '''
+    Makes a cards.json style dict for a made up map.
+    The cities sit on a ring, each linked to the degree // 2 nearest cities either side. The link to the
+    next city on the ring always stays, so the map is always connected. Every other link has a rewire chance
+    of going to a random city instead, which gives mostly local links and a few long hops, like the real board.
+    degree must be an even number of at least 2, and there must be at least one city per colour.
+    Colours are handed out in contiguous regions of the ring. Past the four real colours they're named 'Colour 5' and up.
+    '''
+    if degree < 2 or degree % 2:
+        raise ValueError(f'degree must be an even number of at least 2, not {degree}')
+    if number_of_colours > number_of_cities:
+        raise ValueError(f'{number_of_cities} cities is too few for {number_of_colours} colours')
+    rng = Random(seed)
+    colours = [BASE_COLOURS[num] if num < len(BASE_COLOURS) else f'Colour {num+1}'
+               for num in range(number_of_colours)]
+    names = [f'City {num+1}' for num in range(number_of_cities)]
+    connections = [set() for name in names]
+    for num in range(number_of_cities):
+        for step in range(1, degree // 2 + 1):
+            target = (num + step) % number_of_cities
+            if step > 1 and rng.random() < rewire:
+                target = rng.randrange(number_of_cities)
+            if target != num:
+                connections[num].add(target)
+                connections[target].add(num)
+
+    cards = {'Start_City': names[0], 'Cards': {}, 'Events': {}}
+    colour_counts = [0] * number_of_colours
+    for num, name in enumerate(names):
+        colour = num * number_of_colours // number_of_cities
+        colour_counts[colour] += 1
+        position = [colour + 1, colour_counts[colour]]
+        cards['Cards'][name] = {
+            'City_ID': [1, *position],
+            'Card_ID': [2, *position],
+            'Infection_ID': [3, *position],
+            'Type': colours[colour],
+            'Population': rng.randrange(500000, 25000000),
+            'Connections': [names[target] for target in sorted(connections[num])],
+            'Players': [],
+            'Blocks': [],
+            'Research': False
+        }
+    for num, event in enumerate(allCards['Events']):
+        cards['Events'][event] = {'Card_ID': [4, number_of_colours + 1, num + 1]}
+    return cards
+
+
+def synthetic_board(number_of_cities, degree=4, number_of_colours=4, infection_cubes=24, rewire=0.1, seed=None):
+    '''
+    A made up board of any size. See synthetic_cards for how the map is built.
+    '''
+    return board_from_cards(synthetic_cards(number_of_cities, degree, number_of_colours, rewire, seed),
+                            infection_cubes)
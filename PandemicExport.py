@@ -0,0 +1,302 @@
+import ast
+import json
+import logging
+import os
+import random
+import sys
+from array import array
+
+from PandemicApp import Game
+
+# Streams self-play trajectories to disk for offline training.
+# Each step is (state encoding, legal action mask, chosen action, reward, done).
+# Steps are buffered per column and written out as a shard of .npy files every chunk_size steps,
+# so memory stays the same size no matter how long the run is.
+# The .npy files are written by hand with the standard library. numpy.load() reads them as is,
+# but nothing here needs numpy installed.
+# A manifest.json next to the shards lists the columns and shards and is rewritten after every shard,
+# so a run that dies part way through still leaves readable data behind.
+# Opening a writer on a directory that already has a manifest carries on from it, so restarted runs add shards.
+# Only one writer should use a directory at a time; parallel workers should each get their own directory.
+#
+# ActionSpace gives every (action, target) pair from Turn.legal_actions() a fixed index so actions and
+# legal masks fit in fixed width columns, and self_play_steps turns a game played by an agent into steps.
+
+_BYTE_ORDER = '<' if sys.byteorder == 'little' else '>'
+
+# column name: (array typecode, npy dtype, is the column one value per step or a row per step)
+COLUMNS = {
+    'state': ('f', f'{_BYTE_ORDER}f4', True),
+    'legal_mask': ('B', '|u1', True),
+    'action': ('i', f'{_BYTE_ORDER}i{array("i").itemsize}', False),
+    'reward': ('f', f'{_BYTE_ORDER}f4', False),
+    'done': ('B', '|u1', False),
+}
+
+MANIFEST = 'manifest.json'
+
+
+def write_npy(path, values, descr, shape):
+    '''
+    Writes an array.array to a version 1.0 .npy file.
+    '''
+    header = repr({'descr': descr, 'fortran_order': False, 'shape': tuple(shape)})
+    # the header is padded with spaces so the data starts on a 64 byte boundary
+    padding = 64 - (10 + len(header) + 1) % 64
+    header = (header + ' ' * padding + '\n').encode('latin1')
+    with open(path, 'wb') as f:
+        f.write(b'\x93NUMPY\x01\x00')
+        f.write(len(header).to_bytes(2, 'little'))
+        f.write(header)
+        values.tofile(f)
+
+
+def read_npy(path, typecode):
+    '''
+    Reads a .npy file written by write_npy back into an array.array. Returns the array and its shape.
+    '''
+    with open(path, 'rb') as f:
+        if f.read(6) != b'\x93NUMPY':
+            raise ValueError(f'{path} is not a .npy file')
+        major = f.read(2)[0]
+        header_length = int.from_bytes(f.read(2 if major == 1 else 4), 'little')
+        header = ast.literal_eval(f.read(header_length).decode('latin1'))
+        values = array(typecode)
+        values.frombytes(f.read())
+    if header['descr'][0] in '<>' and header['descr'][0] != _BYTE_ORDER:
+        values.byteswap()
+    return values, header['shape']
+
+
+class TrajectoryWriter(object):
+    '''
+    Buffers steps column by column and writes a shard every chunk_size steps.
+    Use as a context manager, or call close() at the end of the run to write the last partial shard.
+    '''
+
+    def __init__(self, directory, state_size, action_size, chunk_size=65536):
+        self.directory = directory
+        self.state_size = state_size
+        self.action_size = action_size
+        self.chunk_size = chunk_size
+        self.shards = []
+        self.rows = 0
+        os.makedirs(self.directory, exist_ok=True)
+        manifest_path = os.path.join(self.directory, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            if (manifest['state_size'], manifest['action_size']) != (state_size, action_size):
+                raise ValueError(f'{directory} holds steps with state size {manifest["state_size"]} and action size '
+                                 f'{manifest["action_size"]}, not {state_size} and {action_size}')
+            self.shards = manifest['shards']
+            self.rows = manifest['rows']
+        self._reset_buffers()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _reset_buffers(self):
+        self.buffers = {name: array(typecode) for name, (typecode, _, _) in COLUMNS.items()}
+        self.buffered = 0
+
+    def add(self, state, legal_mask, action, reward, done):
+        '''
+        Adds one step. state and legal_mask must be the widths given when the writer was made.
+        '''
+        if len(state) != self.state_size:
+            raise ValueError(f'state has {len(state)} values, expected {self.state_size}')
+        if len(legal_mask) != self.action_size:
+            raise ValueError(f'legal_mask has {len(legal_mask)} values, expected {self.action_size}')
+        self.buffers['state'].extend(state)
+        self.buffers['legal_mask'].extend(legal_mask)
+        self.buffers['action'].append(action)
+        self.buffers['reward'].append(reward)
+        self.buffers['done'].append(int(done))
+        self.buffered += 1
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def add_trajectory(self, steps):
+        '''
+        Adds every (state, legal_mask, action, reward, done) step from an iterable, e.g. a generator from a game.
+        '''
+        for step in steps:
+            self.add(*step)
+
+    def flush(self):
+        '''
+        Writes whatever is buffered as a new shard and updates the manifest.
+        '''
+        if self.buffered == 0:
+            return
+        # claim the next unused shard name. Skips any left behind by a run that died before updating the manifest.
+        number = len(self.shards)
+        while True:
+            shard = f'shard_{number:05d}'
+            try:
+                os.makedirs(os.path.join(self.directory, shard))
+                break
+            except FileExistsError:
+                number += 1
+        widths = {'state': self.state_size, 'legal_mask': self.action_size}
+        for name, (_, descr, is_row) in COLUMNS.items():
+            shape = (self.buffered, widths[name]) if is_row else (self.buffered,)
+            write_npy(os.path.join(self.directory, shard, f'{name}.npy'), self.buffers[name], descr, shape)
+        self.shards.append({'name': shard, 'rows': self.buffered})
+        self.rows += self.buffered
+        self._reset_buffers()
+        self.write_manifest()
+
+    def write_manifest(self):
+        manifest = {
+            'columns': {name: descr for name, (_, descr, _) in COLUMNS.items()},
+            'state_size': self.state_size,
+            'action_size': self.action_size,
+            'rows': self.rows,
+            'shards': self.shards,
+        }
+        # write to a temp file then swap it in so readers never see half a manifest
+        temp_path = os.path.join(self.directory, MANIFEST + '.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(temp_path, os.path.join(self.directory, MANIFEST))
+
+    def close(self):
+        self.flush()
+        self.write_manifest()
+
+
+def read_shards(directory, columns=None):
+    '''
+    Generator that yields one shard at a time as a dict of column name -> flat array.array.
+    Row columns (state, legal_mask) are flattened row after row; the manifest has their widths.
+    Only one shard is held in memory at a time.
+    '''
+    with open(os.path.join(directory, MANIFEST), 'r') as f:
+        manifest = json.load(f)
+    columns = columns or list(COLUMNS)
+    for shard in manifest['shards']:
+        yield {name: read_npy(os.path.join(directory, shard['name'], f'{name}.npy'), COLUMNS[name][0])[0]
+               for name in columns}
+
+
+def read_steps(directory):
+    '''
+    Generator that yields (state, legal_mask, action, reward, done) one step at a time, in the order they were written.
+    '''
+    with open(os.path.join(directory, MANIFEST), 'r') as f:
+        manifest = json.load(f)
+    state_size = manifest['state_size']
+    action_size = manifest['action_size']
+    for shard in read_shards(directory):
+        for row in range(len(shard['action'])):
+            yield (shard['state'][row * state_size:(row + 1) * state_size],
+                   shard['legal_mask'][row * action_size:(row + 1) * action_size],
+                   shard['action'][row],
+                   shard['reward'][row],
+                   bool(shard['done'][row]))
+
+
+class ActionSpace(object):
+    '''
+    Fixed numbering of every action a game can have, laid out as
+    Move to each city, Direct Flight to each city, Charter Flight to each city,
+    Treat each colour, Discover Cure for each colour, Discard each player card, then Pass.
+    Cities are in gameCities order, colours in InfectionCubes order and cards in Board.card_index order.
+    '''
+
+    city_actions = ['Move', 'Direct Flight', 'Charter Flight']
+    colour_actions = ['Treat', 'Discover Cure']
+
+    def __init__(self, game):
+        self.cities = list(game.gameCities)
+        self.colours = list(game.InfectionCubes)
+        self.cards = list(game.CardNames)
+        self.targets = {}
+        self.offsets = {}
+        offset = 0
+        for action in self.city_actions:
+            self.offsets[action], self.targets[action] = offset, self.cities
+            offset += len(self.cities)
+        for action in self.colour_actions:
+            self.offsets[action], self.targets[action] = offset, self.colours
+            offset += len(self.colours)
+        self.offsets['Discard'], self.targets['Discard'] = offset, self.cards
+        offset += len(self.cards)
+        self.offsets['Pass'], self.targets['Pass'] = offset, [None]
+        self.size = offset + 1
+        self.positions = {action: {target: num for num, target in enumerate(targets)}
+                          for action, targets in self.targets.items()}
+
+    def index(self, action):
+        name, target = action
+        return self.offsets[name] + self.positions[name][target]
+
+    def action(self, index):
+        for name, offset in self.offsets.items():
+            if offset <= index < offset + len(self.targets[name]):
+                return (name, self.targets[name][index - offset])
+        raise IndexError(f'{index} is outside an action space of {self.size}')
+
+    def mask(self, actions):
+        mask = [0] * self.size
+        for action in actions:
+            mask[self.index(action)] = 1
+        return mask
+
+
+def self_play_steps(agent, seed, number_of_players=2, number_of_epidemics=4, max_turns=200, board=None):
+    '''
+    Generator that plays one seeded game with the agent making every decision and yields
+    (state, legal_mask, action, reward, done) for each decision, ready for TrajectoryWriter.add.
+    state is GameState.encode() before the decision and action is its ActionSpace index.
+    The last step has done set and a reward of 1 for a win, -1 for a loss and 0 if max_turns ran out.
+    '''
+    random.seed(seed)
+    game = Game(0, number_of_players, number_of_epidemics, board=board, save_states=False)
+    game.actionlogging.setLevel(logging.WARNING)
+    game.setup_game()
+    if hasattr(agent, 'start_game'):
+        agent.start_game(seed)
+    space = ActionSpace(game)
+    turn_steps = []
+
+    def choose(game, player, actions):
+        action = agent.choose(game, player, actions)
+        turn_steps.append((game.GameState.encode(), space.mask(actions), space.index(action)))
+        return action
+
+    last_step = None
+    while not game.is_terminal() and game.turncounter <= max_turns:
+        game.play_turn(choose)
+        # a step's reward and done are only known once the next decision comes, so one step is held back
+        for step in turn_steps:
+            if last_step is not None:
+                yield (*last_step, 0.0, False)
+            last_step = step
+        turn_steps.clear()
+    if last_step is not None:
+        reward = {'Win': 1.0, 'Loss': -1.0}.get(game.result, 0.0)
+        yield (*last_step, reward, True)
+
+
+def export_self_play(directory, agent, seeds, number_of_players=2, number_of_epidemics=4, max_turns=200,
+                     board=None, chunk_size=65536):
+    '''
+    Plays a game for each seed and streams every step into directory. Returns the number of rows written.
+    '''
+    writer = None
+    rows = 0
+    for seed in seeds:
+        for step in self_play_steps(agent, seed, number_of_players, number_of_epidemics, max_turns, board):
+            if writer is None:
+                writer = TrajectoryWriter(directory, len(step[0]), len(step[1]), chunk_size)
+            writer.add(*step)
+            rows += 1
+    if writer is not None:
+        writer.close()
+    return rows
@@ -5,4 +5,6 @@ with open('./variables/cities.json','r') as f:
 with open('./variables/player_cards.json','r') as f:
     playerCards = json.load(f)
 with open('./variables/infection_cards.json','r') as f:
-    infectionCards = json.load(f)
\ No newline at end of file
+    infectionCards = json.load(f)
+with open('./variables/cards.json','r') as f:
+    allCards = json.load(f)
@@ -0,0 +1,265 @@
+import logging
+import random
+from collections import deque
+from itertools import combinations
+from math import log, sqrt
+
+from PandemicApp import Game
+
+# Plays agents against the same seeded games and compares them.
+# Every agent plays the same seeds with the same player/epidemic settings, so results are compared in pairs
+# and the luck of the deal cancels out. Each pair of agents runs a sequential probability ratio test (SPRT)
+# on which agent did better on each seed, and the tournament stops as soon as every pair has a verdict
+# instead of always playing max_games.
+#
+# An agent is any object with choose(game, player, actions) returning one of the (action, target) pairs
+# from Turn.legal_actions(), including which card to discard when over the hand limit.
+# start_game(seed) is called before each game if the agent has it.
+
+
+class RandomAgent(object):
+    '''
+    Picks any legal action other than passing.
+    '''
+
+    def __init__(self):
+        self.rng = random.Random()
+
+    def start_game(self, seed):
+        # own random stream so the agent doesn't shift the game's shuffles
+        self.rng.seed(seed)
+
+    def choose(self, game, player, actions):
+        return self.rng.choice([action for action in actions if action[0] != 'Pass'] or actions)
+
+
+class GreedyAgent(object):
+    '''
+    Cures whenever it can, treats the colour with the most cubes where it stands,
+    heads for a research station when it holds enough cards to cure, and otherwise walks to the nearest cubes.
+    Never spends cards on flights. Over the hand limit it lets go of the colour it holds fewest of, events last.
+    '''
+
+    def choose(self, game, player, actions):
+        if actions[0][0] == 'Discard':
+            return ('Discard', game.Turn.default_discard())
+        cures = [action for action in actions if action[0] == 'Discover Cure']
+        if cures:
+            return cures[0]
+        city = game.gameCities[player.location]
+        treats = [action for action in actions if action[0] == 'Treat']
+        if treats:
+            return max(treats, key=lambda action: city.cubes[action[1]])
+        if any(player.hand.can_cure(color) for color in game.InfectionCubes if color not in game.CuredDiseases):
+            step = self.step_towards(game, player.location, lambda other: other.research_station)
+        else:
+            step = self.step_towards(game, player.location, lambda other: other.total_cubes > 0)
+        if step and ('Move', step) in actions:
+            return ('Move', step)
+        return ('Pass', None)
+
+    def step_towards(self, game, start, goal):
+        '''
+        Breadth first search for the nearest city passing goal. Returns the first move on the way there.
+        '''
+        first_steps = {start: None}
+        queue = deque([start])
+        while queue:
+            name = queue.popleft()
+            city = game.gameCities[name]
+            if name != start and goal(city):
+                return first_steps[name]
+            for connection in city.connected_cities:
+                if connection in game.gameCities and connection not in first_steps:
+                    first_steps[connection] = first_steps[name] or connection
+                    queue.append(connection)
+        return None
+
+
+def play_game(agent, seed, number_of_players=2, number_of_epidemics=4, max_turns=200, board=None):
+    '''
+    Plays one game with the agent controlling every player. Returns a record of how it went.
+    '''
+    random.seed(seed)
+    game = Game(0, number_of_players, number_of_epidemics, board=board, save_states=False)
+    game.actionlogging.setLevel(logging.WARNING)
+    game.setup_game()
+    if hasattr(agent, 'start_game'):
+        agent.start_game(seed)
+    while not game.is_terminal() and game.turncounter <= max_turns:
+        game.play_turn(agent.choose)
+    return {
+        'seed': seed,
+        'players': number_of_players,
+        'epidemics': number_of_epidemics,
+        'won': game.result == 'Win',
+        'lost': game.result == 'Loss',
+        'turns': game.Turn.turncounter,
+        'outbreaks': game.Outbreaks,
+        'cures': len(game.CuredDiseases),
+    }
+
+
+def outcome_key(record):
+    '''
+    Orders two records of the same seed. Winning beats losing, then more cures,
+    then winning faster or losing slower, then fewer outbreaks.
+    '''
+    return (record['won'], record['cures'], -record['turns'] if record['won'] else record['turns'], -record['outbreaks'])
+
+
+def wilson_interval(successes, games, z=1.96):
+    '''
+    Confidence interval for a win rate. Behaves better than the normal interval near 0 and 1.
+    '''
+    if games == 0:
+        return (0.0, 1.0)
+    rate = successes / games
+    centre = (rate + z * z / (2 * games)) / (1 + z * z / games)
+    spread = z * sqrt(rate * (1 - rate) / games + z * z / (4 * games * games)) / (1 + z * z / games)
+    return (max(0.0, centre - spread), min(1.0, centre + spread))
+
+
+def mean_interval(values, z=1.96):
+    '''
+    Mean with a normal confidence interval. Returns (mean, low, high).
+    '''
+    if not values:
+        return (0.0, 0.0, 0.0)
+    mean = sum(values) / len(values)
+    if len(values) < 2:
+        return (mean, mean, mean)
+    variance = sum((value - mean) ** 2 for value in values) / (len(values) - 1)
+    spread = z * sqrt(variance / len(values))
+    return (mean, mean - spread, mean + spread)
+
+
+class PairedSPRT(object):
+    '''
+    Sequential test on seeds where one agent did better than the other (ties are skipped).
+    Two of Wald's SPRTs run side by side, p = 0.5 against p = 0.5 + delta and against p = 0.5 - delta.
+    The verdict is the first agent better, the second better, or no difference of delta or more.
+    '''
+
+    def __init__(self, alpha=0.05, beta=0.1, delta=0.15):
+        self.accept = log((1 - beta) / alpha)
+        self.reject = log(beta / (1 - alpha))
+        self.p_better = 0.5 + delta
+        self.p_worse = 0.5 - delta
+        self.llr_better = 0.0
+        self.llr_worse = 0.0
+        self.wins = 0
+        self.losses = 0
+        self.ties = 0
+        self.decision = None
+
+    def update(self, first, second):
+        if self.decision is not None:
+            return self.decision
+        first_key, second_key = outcome_key(first), outcome_key(second)
+        if first_key > second_key:
+            self.wins += 1
+            self.llr_better += log(self.p_better / 0.5)
+            self.llr_worse += log(self.p_worse / 0.5)
+        elif first_key < second_key:
+            self.losses += 1
+            self.llr_better += log((1 - self.p_better) / 0.5)
+            self.llr_worse += log((1 - self.p_worse) / 0.5)
+        else:
+            self.ties += 1
+            return None
+        if self.llr_better >= self.accept:
+            self.decision = 'first better'
+        elif self.llr_worse >= self.accept:
+            self.decision = 'second better'
+        elif self.llr_better <= self.reject and self.llr_worse <= self.reject:
+            self.decision = 'no difference'
+        return self.decision
+
+
+class Tournament(object):
+    '''
+    Plays every agent on the same seeds, cycling through configs of (number_of_players, number_of_epidemics),
+    until every pair of agents has an SPRT verdict or max_games seeds have been played.
+    Agents whose pairs are all decided sit out the remaining seeds.
+    '''
+
+    def __init__(self, agents, configs=((2, 4),), max_turns=200, min_games=20, max_games=1000,
+                 alpha=0.05, beta=0.1, delta=0.15, seed=0, board=None):
+        self.agents = agents
+        self.configs = list(configs)
+        self.max_turns = max_turns
+        self.min_games = min_games
+        self.max_games = max_games
+        self.seed = seed
+        self.board = board
+        self.records = {name: [] for name in agents}
+        self.tests = {pair: PairedSPRT(alpha, beta, delta) for pair in combinations(agents, 2)}
+        self.games_played = 0
+
+    def undecided_agents(self):
+        return {name for pair, test in self.tests.items() if test.decision is None for name in pair}
+
+    def run(self):
+        for game_number in range(self.max_games):
+            playing = self.undecided_agents() if game_number >= self.min_games else set(self.agents)
+            if not playing:
+                break
+            seed = self.seed + game_number
+            number_of_players, number_of_epidemics = self.configs[game_number % len(self.configs)]
+            results = {}
+            for name in playing:
+                results[name] = play_game(self.agents[name], seed, number_of_players, number_of_epidemics,
+                                          self.max_turns, self.board)
+                self.records[name].append(results[name])
+            for (first, second), test in self.tests.items():
+                if first in results and second in results:
+                    test.update(results[first], results[second])
+            self.games_played += 1
+        return self.summary()
+
+    def summarise(self, records):
+        wins = sum(record['won'] for record in records)
+        return {
+            'games': len(records),
+            'win_rate': wins / len(records) if records else 0.0,
+            'win_rate_interval': wilson_interval(wins, len(records)),
+            'turns_to_loss': mean_interval([record['turns'] for record in records if record['lost']]),
+            'outbreaks': mean_interval([record['outbreaks'] for record in records]),
+            'cures': mean_interval([record['cures'] for record in records]),
+        }
+
+    def summary(self):
+        agents = {}
+        for name, records in self.records.items():
+            agents[name] = {'overall': self.summarise(records)}
+            for number_of_players, number_of_epidemics in self.configs:
+                agents[name][(number_of_players, number_of_epidemics)] = self.summarise(
+                    [record for record in records
+                     if (record['players'], record['epidemics']) == (number_of_players, number_of_epidemics)])
+        comparisons = {pair: {'decision': test.decision, 'wins': test.wins, 'losses': test.losses, 'ties': test.ties}
+                       for pair, test in self.tests.items()}
+        return {'seeds_played': self.games_played, 'agents': agents, 'comparisons': comparisons}
+
+    def report(self):
+        summary = self.summary()
+        lines = [f'{summary["seeds_played"]} seeds played']
+        for name, results in summary['agents'].items():
+            for config, stats in results.items():
+                low, high = stats['win_rate_interval']
+                turns, outbreaks, cures = stats['turns_to_loss'], stats['outbreaks'], stats['cures']
+                lines.append(f'{name} {config}: {stats["games"]} games, win rate {stats["win_rate"]:.2f} [{low:.2f}, {high:.2f}], '
+                             f'turns to loss {turns[0]:.1f} [{turns[1]:.1f}, {turns[2]:.1f}], '
+                             f'outbreaks {outbreaks[0]:.2f} [{outbreaks[1]:.2f}, {outbreaks[2]:.2f}], '
+                             f'cures {cures[0]:.2f} [{cures[1]:.2f}, {cures[2]:.2f}]')
+        for (first, second), result in summary['comparisons'].items():
+            lines.append(f'{first} vs {second}: {result["decision"] or "undecided"} '
+                         f'({result["wins"]}-{result["losses"]}, {result["ties"]} ties)')
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    tournament = Tournament({'random': RandomAgent(), 'greedy': GreedyAgent()},
+                            configs=[(2, 4), (3, 5), (4, 6)])
+    tournament.run()
+    print(tournament.report())